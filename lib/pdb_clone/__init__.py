@@ -26,6 +26,9 @@ PY33 = (sys.version_info >= (3, 3))
 # Python 3.4 or newer
 PY34 = (sys.version_info >= (3, 4))
 
+# Python 3.6 or newer
+PY36 = (sys.version_info >= (3, 6))
+
 if PY26 or (PY3 and not PY32):
     raise NotImplementedError('Python 2.7 or Python 3.2 or newer is required.')
 
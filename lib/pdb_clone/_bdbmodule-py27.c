@@ -181,30 +181,31 @@ stop_here(BdbTracer *self, PyFrameObject *frame)
 {
     PyObject *result;
     int lineno;
+    int rc;
+
+    if ((PyObject *)frame != self->stopframe && self->stopframe != Py_None)
+        return 0;
+
+    lineno = PyLong_AsLong(self->stop_lineno);
+    if (lineno == -1 && PyErr_Occurred())
+        return -1;
+    if (lineno == -1 || frame->f_lineno < lineno)
+        return 0;
 
+    /* Check the skipped modules last, as this is the most expensive. */
     if (PyTuple_GET_SIZE(self->skip_modules)) {
         result = PyObject_CallMethod((PyObject *)self, "is_skipped_module",
                                      "(O)", frame);
         if (result == NULL)
             return -1;
-        if (PyObject_IsTrue(result)) {
-            Py_DECREF(result);
-            return 0;
-        }
+        rc = PyObject_IsTrue(result);
         Py_DECREF(result);
+        if (rc == -1)
+            return -1;
+        return !rc;
     }
 
-    lineno = PyLong_AsLong(self->stop_lineno);
-    if (lineno == -1 && PyErr_Occurred())
-        return -1;
-
-    if ((PyObject *)frame == self->stopframe || self->stopframe == Py_None) {
-        if (lineno == -1)
-            return 0;
-        return frame->f_lineno >= lineno;
-    }
-
-    return 0;
+    return 1;
 }
 
 static PyObject *
@@ -809,6 +810,77 @@ static PyTypeObject BdbTracer_Type = {
     0,                              /*tp_is_gc*/
 };
 
+/* The list of the source code line numbers of a code object (see
+ * Objects/lnotab_notes.txt), the C implementation of
+ * bdb.code_line_numbers(). */
+static PyObject *
+code_line_numbers(PyObject *module, PyObject *args)
+{
+    PyCodeObject *code;
+    PyObject *lnotab = NULL;
+    PyObject *result = NULL;
+    PyObject *item;
+    const unsigned char *p;
+    Py_ssize_t size;
+    Py_ssize_t i;
+    long lno;
+    long valid_lno;
+
+    if (! PyArg_ParseTuple(args, "O!:code_line_numbers", &PyCode_Type, &code))
+        return NULL;
+
+    lnotab = PyObject_GetAttrString((PyObject *)code, "co_lnotab");
+    if (lnotab == NULL)
+        return NULL;
+    if (! PyString_Check(lnotab)) {
+        PyErr_SetString(PyExc_TypeError, "invalid co_lnotab type");
+        goto fin;
+    }
+    p = (const unsigned char *)PyString_AS_STRING(lnotab);
+    size = PyString_GET_SIZE(lnotab);
+
+    result = PyList_New(0);
+    if (result == NULL)
+        goto fin;
+    valid_lno = lno = code->co_firstlineno;
+    item = PyInt_FromLong(valid_lno);
+    if (item == NULL || PyList_Append(result, item)) {
+        Py_XDECREF(item);
+        Py_CLEAR(result);
+        goto fin;
+    }
+    Py_DECREF(item);
+
+    /* Each line increment is followed by the byte increment of the next
+     * entry, a null byte increment means that the line increment continues
+     * in the next entry. */
+    for (i = 1; i < size; i += 2) {
+        lno += p[i];
+        if (i + 1 < size && p[i + 1] == 0)
+            continue;
+        if (lno != valid_lno) {
+            valid_lno = lno;
+            item = PyInt_FromLong(valid_lno);
+            if (item == NULL || PyList_Append(result, item)) {
+                Py_XDECREF(item);
+                Py_CLEAR(result);
+                goto fin;
+            }
+            Py_DECREF(item);
+        }
+    }
+
+fin:
+    Py_DECREF(lnotab);
+    return result;
+}
+
+static PyMethodDef _bdb_methods[] = {
+    {"code_line_numbers", code_line_numbers, METH_VARARGS,
+            PyDoc_STR("The list of the source code line numbers of a code.")},
+    {NULL, NULL} /* sentinel */
+};
+
 PyDoc_STRVAR(module_doc, "The _bdb module.");
 
 #ifndef PyMODINIT_FUNC  /* declarations for DLL import/export */
@@ -824,7 +896,7 @@ init_bdb(void)
     if (PyType_Ready(&BdbTracer_Type) < 0)
         return;
 
-    m = Py_InitModule3("_bdb", NULL, module_doc);
+    m = Py_InitModule3("_bdb", _bdb_methods, module_doc);
 
     if (m == NULL)
       return;
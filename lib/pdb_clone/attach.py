@@ -15,43 +15,100 @@ and have it continue its execution without tracing overhead.
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
-try:
-    import StringIO
-except ImportError:
-    pass
 
 import sys
 import os
-import io
+import re
 import cmd
-import argparse
 import signal
 import time
-import random
 import socket
+import select
 import asyncore
 import asynchat
 import errno
-from itertools import takewhile
 from collections import deque
-from subprocess import Popen, STDOUT, PIPE
 
 from . import PY3, DFLT_ADDRESS, pdb
 
 prompts = ('(Pdb) ', '(com) ', '((Pdb)) ', '>>> ', '... ')
 line_prmpts = tuple('\n%s' % p for p in prompts)
+# Match a prompt at the end of the raw pdb output, the search is started at
+# 'len(data) - prompt_maxlen' to only scan the tail of the output. The
+# prompts are ascii, their length in bytes is their length in characters.
+prompt_re = re.compile((r'(?:\A|\n)(%s)\Z' %
+                '|'.join(re.escape(p) for p in prompts)).encode('utf-8'))
+prompt_maxlen = max(len(p) for p in line_prmpts)
 
-class AttachSocket(asynchat.async_chat, cmd.Cmd):
+class _NullFile:
+    """A file object that discards its output."""
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+_DEV_NULL = _NullFile()
+
+# Map the signal numbers to their names. The names are sorted, so the first
+# name is used for aliases such as SIGABRT and SIGIOT.
+_SIGNAL_NAMES = {}
+for name in dir(signal):
+    if name.startswith('SIG') and not name.startswith('SIG_'):
+        _SIGNAL_NAMES.setdefault(int(getattr(signal, name)), name)
+del name
+
+# Used by the SIGINT handler.
+_OS_KILL = os.kill
+_SIGINT = signal.SIGINT
+
+_BLOCKING = frozenset((errno.EAGAIN, errno.EWOULDBLOCK))
+_DISCONNECTED = frozenset((errno.ECONNRESET, errno.ENOTCONN, errno.ESHUTDOWN,
+                           errno.ECONNABORTED, errno.EPIPE, errno.EBADF))
+
+class BufferedChat(asynchat.async_chat):
+    """An async_chat without terminator that reads into a fixed buffer.
+
+    collect_incoming_data() is called with a memoryview of this buffer that is
+    only valid until the next read.
+    """
+
+    recv_size = 65536
+
+    def __init__(self, sock=None, map=None):
+        asynchat.async_chat.__init__(self, sock, map)
+        self.set_terminator(None)
+        self.recvbuf = bytearray(self.recv_size)
+        self.recvview = memoryview(self.recvbuf)
+
+    def handle_read(self):
+        try:
+            size = self.socket.recv_into(self.recvbuf)
+        except socket.error as err:
+            if err.args[0] in _BLOCKING:
+                return
+            if err.args[0] in _DISCONNECTED:
+                self.handle_close()
+            else:
+                self.handle_error()
+            return
+        if not size:
+            self.handle_close()
+        else:
+            self.collect_incoming_data(self.recvview[:size])
+
+class AttachSocket(BufferedChat, cmd.Cmd):
     """A socket connected to a remote Pdb instance."""
 
     def __init__(self, connections, completekey='tab', stdin=None, stdout=None):
-        asynchat.async_chat.__init__(self, map=connections)
+        BufferedChat.__init__(self, map=connections)
         cmd.Cmd.__init__(self, completekey, stdin, stdout)
         if stdout:
             self.use_rawinput = 0
-        self.set_terminator(None)
         self.allow_kbdint = False
-        self.data = b''
+        self.data = bytearray()
+        self._scan_off = 0
         self.remote = ''
         self.pid = 0
         self._previous_sigint_handler = None
@@ -63,16 +120,28 @@ class AttachSocket(asynchat.async_chat, cmd.Cmd):
         printflush(*objs, **kwds)
 
     def sigint_handler(self, signum, frame):
-        if self.allow_kbdint:
+        # The handler is installed on connection, before the PROCESS_PID
+        # header line has been received.
+        if self.allow_kbdint or not self.pid:
             raise KeyboardInterrupt
-        if self.pid:
-            try:
-                os.kill(self.pid, signal.SIGINT)
-            except OSError as err:
-                self.message(err)
+        try:
+            _OS_KILL(self.pid, _SIGINT)
+        except OSError as err:
+            self.message(err)
 
     def handle_connect(self):
-        pass
+        # Do not delay the small writes of the pdb commands.
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._previous_sigint_handler = signal.signal(signal.SIGINT,
+                                                    self.sigint_handler)
+
+    def close(self):
+        try:
+            if self._previous_sigint_handler:
+                signal.signal(signal.SIGINT, self._previous_sigint_handler)
+                self._previous_sigint_handler = None
+        finally:
+            asynchat.async_chat.close(self)
 
     def handle_error(self):
         self.close()
@@ -86,79 +155,96 @@ class AttachSocket(asynchat.async_chat, cmd.Cmd):
 
     def handle_close (self):
         if self.connected:
-            if self._previous_sigint_handler:
-                signal.signal(signal.SIGINT, self._previous_sigint_handler)
-            content = _decode(self.data, encoding='utf-8')
+            # The remote may have closed the socket in the middle of a
+            # multibyte character.
+            content = _decode(bytes(self.data), encoding='utf-8',
+                              errors='replace')
             if content:
                 self.message(content.rstrip('\n'))
             self.message('Closed by remote.')
             self.close()
 
     def collect_incoming_data(self, data):
-        self.data += data
+        # Extend the buffer in place and do not search again the bytes already
+        # scanned for a new line, to avoid copying the whole buffer on each
+        # received chunk.
+        self.data.extend(data)
         while self.data and not self.remote:
-            idx = self.data.find(b'\n')
-            if idx != -1:
-                if idx > 0:
-                    self.get_header(_decode(self.data[:idx], encoding='utf-8'))
-                self.data = self.data[idx + 1:]
-                continue
-            return
+            idx = self.data.find(b'\n', self._scan_off)
+            if idx == -1:
+                self._scan_off = len(self.data)
+                return
+            if idx > 0:
+                self.get_header(self.data[:idx])
+            del self.data[:idx + 1]
+            self._scan_off = 0
         if self.data:
             self.interaction()
 
     def connect_retry(self, address, verbose):
-        skip_connect = 5
+        # Retry with an exponential backoff of the delay between two
+        # connection attempts, up to 200 msecs, and give up after 4 seconds.
+        skip_connect = 1
+        timeout = 4
+        delay = 0.005
         count = 0
+        printing = False
+        start = time.time()
         while not self.connected:
             try:
                 self.connect(address)
             except IOError as err:
                 if err.errno != errno.ECONNREFUSED:
                     raise
-                # Skip printing the first connection failures.
-                if count >= skip_connect and verbose:
-                    if count == skip_connect:
-                        printflush('Connecting to remote pdb' +
-                                skip_connect * '.', end='')
+                elapsed = time.time() - start
+                # Skip printing the connection failures of the first second.
+                if elapsed >= skip_connect and verbose:
+                    if not printing:
+                        printing = True
+                        _emit('Connecting to remote pdb' + 5 * '.', end='')
                     else:
-                        printflush('.', end='')
+                        _emit('.', end='')
                 count += 1
-                if count >= 20:
+                if elapsed >= timeout:
                     if verbose:
-                        printflush('failed')
+                        _emit('failed')
                     self.close()
                     raise
                 yield count
-                time.sleep(0.200)
-        if verbose and count > skip_connect:
-            printflush('ok')
+                time.sleep(delay)
+                delay = min(delay * 2, 0.200)
+            else:
+                # The connection is in progress, wait for the socket to be
+                # writable before checking again its state.
+                if not self.connected:
+                    select.select([], [self.socket], [], delay)
+        if verbose and printing:
+            _emit('ok')
 
     def get_header(self, line):
-        if line.startswith('PROCESS_PID:'):
-            self.pid = int(line.split(':')[1])
-            self._previous_sigint_handler = signal.signal(signal.SIGINT,
-                                                        self.sigint_handler)
-        elif line.startswith('PROCESS_NAME:'):
-            self.remote = line.split(':', 1)[1]
+        # 'line' is a bytearray, only the process name needs to be decoded.
+        if line.startswith(b'PROCESS_PID:'):
+            self.pid = int(line[len(b'PROCESS_PID:'):])
+        elif line.startswith(b'PROCESS_NAME:'):
+            self.remote = _decode(bytes(line[len(b'PROCESS_NAME:'):]),
+                                  encoding='utf-8')
             msg = ('Connected to %s at %s' %
                     (os.path.basename(self.remote), str(self.addr)))
             end = ', pid: %d.' % self.pid if self.pid else '.'
             msg += end
             self.message(msg)
         else:
+            line = _decode(bytes(line), encoding='utf-8', errors='replace')
             self.message('Invalid header line: %s' % line)
 
     def interaction(self):
-        content = _decode(self.data, encoding='utf-8')
-        plen = 0
-        if content.endswith(line_prmpts) or content in prompts:
-            for i in range(len(prompts)):
-                if content.endswith(line_prmpts[i]) or content == prompts[i]:
-                    plen = len(prompts[i])
-                    break
-        if plen:
-            self.data = b''
+        # Do not decode the output until the prompt has been received.
+        match = prompt_re.search(self.data,
+                                 max(0, len(self.data) - prompt_maxlen))
+        if match:
+            plen = len(match.group(1))
+            content = _decode(bytes(self.data), encoding='utf-8')
+            del self.data[:]
             self.message(content[:-plen], end='')
             self.prompt = content[-plen:]
             while True:
@@ -186,16 +272,20 @@ class AttachSocket(asynchat.async_chat, cmd.Cmd):
         self.push(_encode(self.curline, encoding='utf-8'))
         return True
 
-    # Add the Pdb 'do_' and 'help_' methods as commands controlled by the
-    # cmd.Cmd completion machinery. They all call the default method, as well
-    # as any unrecognized command.
-    for name in dir(pdb.Pdb):
-        if name.startswith('do_'):
-            exec('def %s(self, l): return self.default(l, cmd="%s")'
-                                                    % (name, name[3:]))
-        elif name.startswith('help_'):
-            exec('def %s(self, l): return self.default(l, cmd="help %s")'
-                                                    % (name, name[5:]))
+def _pdb_command(cmd):
+    def method(self, l):
+        return self.default(l, cmd=cmd)
+    return method
+
+# Add the Pdb 'do_' and 'help_' methods as commands controlled by the
+# cmd.Cmd completion machinery. They all call the default method, as well
+# as any unrecognized command.
+for name in dir(pdb.Pdb):
+    if name.startswith('do_'):
+        setattr(AttachSocket, name, _pdb_command(name[3:]))
+    elif name.startswith('help_'):
+        setattr(AttachSocket, name, _pdb_command('help ' + name[5:]))
+del name
 
 class AttachSocketWithDetach(AttachSocket):
     """A socket connected to a remote Pdb instance.
@@ -204,9 +294,9 @@ class AttachSocketWithDetach(AttachSocket):
     """
 
     def interaction(self):
-        content = _decode(self.data, encoding='utf-8')
-        if content.endswith(line_prmpts) or content in prompts:
-            self.data = b''
+        if prompt_re.search(self.data,
+                            max(0, len(self.data) - prompt_maxlen)):
+            del self.data[:]
             self.push(_encode('detach\n', encoding='utf-8'))
 
 class Result:
@@ -235,6 +325,8 @@ class StatementLine:
         self.line = ''
         self.skipping = False
         self.lines = deque()
+        # The set of the lines in the 'lines' deque, for membership tests.
+        self.lineset = set()
 
     def set_line(self, line):
         self.line = line
@@ -245,25 +337,26 @@ class StatementLine:
         line = self.line
         self.line = ''
         # 'line' is the statement line of the previous py-pdb command.
-        if line in self.lines:
+        if line in self.lineset:
             if not self.skipping:
                 self.skipping = True
-                printflush('Skipping lines', end='')
-            printflush('.', end='')
+                _emit('Skipping lines', end='')
+            _emit('.', end='')
             return True
         elif line:
             self.lines.append(line)
+            self.lineset.add(line)
             if len(self.lines) > 30:
-                self.lines.popleft()
+                self.lineset.discard(self.lines.popleft())
 
         return False
 
     def print(self):
-        if self.line and self.line not in self.lines:
+        if self.line and self.line not in self.lineset:
             if self.skipping:
                 self.skipping = False
                 print('')
-            printflush(self.line)
+            _emit(self.line)
 
 class Context:
     """The execution context shared by all the GdbSocket instances."""
@@ -271,14 +364,14 @@ class Context:
         self.result = Result()
         self.stmt= StatementLine()
 
-class GdbSocket(asynchat.async_chat):
+class GdbSocket(BufferedChat):
     """The gdb/mi socket connection."""
 
     ST_INIT, ST_PDB, ST_EXIT, ST_TERMINATED = tuple(range(4))
 
     def __init__(self, ctx, address, proc, proc_iut, sock,
                  verbose, connections):
-        asynchat.async_chat.__init__(self, sock, connections)
+        BufferedChat.__init__(self, sock, connections)
         self.ctx = ctx
         self.address = address
         self.proc = proc
@@ -288,8 +381,9 @@ class GdbSocket(asynchat.async_chat):
         self.error = None
         self.state = self.ST_INIT
         self.gdb_version = None
-        self.set_terminator(b'\n')
-        self.ibuff = io.StringIO() if PY3 else StringIO.StringIO()
+        # The lines are split by collect_incoming_data() from this buffer,
+        # asynchat copies its whole input buffer on each terminator found.
+        self.ibuff = bytearray()
 
         # Setup gdb to not stop the inferior on the following signals.
         self.cli_command('handle SIGPIPE noprint')
@@ -310,27 +404,25 @@ class GdbSocket(asynchat.async_chat):
     def handle_close (self):
         if self.connected:
             if not self.ctx:
-                printflush('Socket closed by gdb.')
+                _emit('Socket closed by gdb.')
             self.close()
 
             # Handle anbormal gdb termination.
             rc = self.proc.wait()
             if rc is not None and rc < 0:
                 self.state = self.ST_TERMINATED
-                signals = dict((getattr(signal, n), n) for n in dir(signal)
-                                                    if n.startswith('SIG'))
-                printflush('Gdb terminated, got signal %s.'
-                                        % signals.get(-rc, -rc))
+                _emit('Gdb terminated, got signal %s.'
+                                        % _SIGNAL_NAMES.get(-rc, -rc))
 
     def mi_command(self, line):
         if not line.endswith('\n'):
             line += '\n'
         if self.verbose:
-            printflush('+++', line, end='')
+            _emit('+++ ' + line, end='')
         self.push(_encode(line))
 
     def cli_command(self, cmd):
-        self.mi_command('-interpreter-exec console "%s"' % cmd)
+        self.mi_command('-interpreter-exec console "%s"\n' % cmd)
 
     def exit(self, msg=None, where=False):
         self.state = self.ST_EXIT
@@ -342,21 +434,28 @@ class GdbSocket(asynchat.async_chat):
 
     def attach(self):
         if self.ctx:
-            dev_null = io.StringIO() if PY3 else StringIO.StringIO()
-            asock = AttachSocketWithDetach(self.connections, stdout=dev_null)
+            asock = AttachSocketWithDetach(self.connections,
+                                           stdout=_DEV_NULL)
         else:
             asock = AttachSocket(self.connections)
         asock.create_socket(socket.AF_INET, socket.SOCK_STREAM)
         connect_process(asock, self.ctx, self.proc_iut, address=self.address)
 
     def collect_incoming_data(self, data):
-        self.ibuff.write(_decode(data))
+        # Process all the complete lines in one pass and keep the trailing
+        # partial line in the buffer.
+        self.ibuff.extend(data)
+        idx = self.ibuff.rfind(b'\n')
+        if idx == -1:
+            return
+        lines = bytes(self.ibuff[:idx]).split(b'\n')
+        del self.ibuff[:idx + 1]
+        for line in lines:
+            self.process_line(_decode(line))
 
-    def found_terminator(self):
-        line = self.ibuff.getvalue()
-        self.ibuff = io.StringIO() if PY3 else StringIO.StringIO()
+    def process_line(self, line):
         if self.verbose:
-            printflush(line)
+            _emit(line)
         elif line.startswith('~"->'):
             line = line[1:].strip('"')
             line = line[:-2] if line.endswith(r'\n') else line
@@ -364,13 +463,27 @@ class GdbSocket(asynchat.async_chat):
                 self.ctx.stmt.set_line(line)
             else:
                 print(line)
+            return
 
+        # Dispatch on the gdb/mi record type.
+        handler = self.mi_handlers.get(line[:1])
+        if handler:
+            handler(self, line)
+
+    def result_record(self, line):
         error_prefix = '^error,msg='
         if line == '^exit':
             self.state = self.ST_TERMINATED
             self.close()
 
-        elif line.startswith('~"') and self.gdb_version is None:
+        elif line.startswith(error_prefix):
+            # Do not overwrite the first error message.
+            if self.state != self.ST_EXIT:
+                err = line[len(error_prefix):].strip('"').replace(r'\n', '\n')
+                self.exit(err)
+
+    def console_stream(self, line):
+        if line.startswith('~"') and self.gdb_version is None:
             self.gdb_version = parse_gdb_version(line)
             if self.gdb_version:
                 if not self.ctx:
@@ -378,13 +491,15 @@ class GdbSocket(asynchat.async_chat):
             else:
                 self.exit('Invalid gdb version line: "%s".' % line)
 
-        elif line.startswith(error_prefix):
-            # Do not overwrite the first error message.
-            if self.state != self.ST_EXIT:
-                err = line[len(error_prefix):].strip('"').replace(r'\n', '\n')
-                self.exit(err)
+        elif self.state == self.ST_PDB:
+            lines = line[1:].strip('"').replace(r'\n', '\n')
+            ok = self.process_result(lines)
+            if ok:
+                self.exit()
+                self.attach()
 
-        elif line.startswith('*stopped,'):
+    def exec_async(self, line):
+        if line.startswith('*stopped,'):
             if line.startswith('*stopped,reason="exited'):
                 self.exit()
             elif line.startswith('*stopped,frame='):
@@ -401,17 +516,18 @@ class GdbSocket(asynchat.async_chat):
                 else:
                     self.exit()
 
-        elif line.startswith('&"') and not line.startswith('&"warning:'):
+    def log_stream(self, line):
+        if line.startswith('&"') and not line.startswith('&"warning:'):
             line = line[1:].strip('"').replace(r'\n', '')
             if line:
                 print(line)
 
-        elif self.state == self.ST_PDB and line.startswith('~'):
-            lines = line[1:].strip('"').replace(r'\n', '\n')
-            ok = self.process_result(lines)
-            if ok:
-                self.exit()
-                self.attach()
+    mi_handlers = {
+        '^': result_record,
+        '~': console_stream,
+        '*': exec_async,
+        '&': log_stream,
+    }
 
     def process_result(self, lines):
         if 'Unable to setup pdb' in lines:
@@ -435,34 +551,33 @@ class GdbSocket(asynchat.async_chat):
             return True
 
 def printflush(*args, **kwds):
-    if 'flush' in kwds:
-        flush = kwds['flush']
-        del kwds['flush']
-    else:
-        flush = True
+    flush = kwds.pop('flush', True)
     print(*args, **kwds)
     if flush:
-        file = kwds.get('file', sys.stdout)
-        file.flush()
-
-def _decode(data, encoding=None):
-    if PY3:
-        if encoding:
-            return data.decode(encoding=encoding)
-        else:
-            return data.decode()
-    else:
+        kwds.get('file', sys.stdout).flush()
+
+def _emit(msg, end='\n'):
+    """Write a string to stdout and flush it."""
+    stdout = sys.stdout
+    stdout.write(msg + end)
+    stdout.flush()
+
+# Select the implementation once instead of testing PY3 on each call.
+if PY3:
+    def _decode(data, encoding='utf-8', errors='strict'):
+        return data.decode(encoding, errors)
+
+    def _encode(data, encoding='utf-8'):
+        return data.encode(encoding)
+else:
+    def _decode(data, encoding=None, errors='strict'):
         return data
 
-def _encode(data, encoding=None):
-    if PY3:
-        if encoding:
-            return data.encode(encoding=encoding)
-        else:
-            return data.encode()
-    else:
+    def _encode(data, encoding=None):
         return data
 
+gdb_version_re = re.compile(r'[0-9.]*')
+
 def parse_gdb_version(line):
     r"""Parse the gdb version from the gdb header.
 
@@ -491,8 +606,7 @@ def parse_gdb_version(line):
             # Strip after first non digit or '.' character. Allow for linux
             # Suse non conformant implementation that encloses the version in
             # brackets.
-            version = ''.join(takewhile(lambda x: x.isdigit() or x == '.',
-                                                    version[1].lstrip('(')))
+            version = gdb_version_re.match(version[1].lstrip('(')).group()
             return version.strip('.')
     return ''
 
@@ -504,6 +618,8 @@ def spawn_gdb(pid, address=DFLT_ADDRESS, gdb='gdb', verbose=False,
               ctx=None, proc_iut=None):
     """Spawn gdb and attach to a process."""
 
+    from subprocess import Popen, STDOUT
+
     parent, child = socket.socketpair()
     proc = Popen([gdb, '--interpreter=mi', '-nx'],
                     bufsize=0, stdin=child, stdout=child, stderr=STDOUT)
@@ -521,6 +637,9 @@ def spawn_gdb(pid, address=DFLT_ADDRESS, gdb='gdb', verbose=False,
 def attach_loop(argv):
     """Spawn the process, then repeatedly attach to the process."""
 
+    import random
+    from subprocess import Popen, STDOUT, PIPE
+
     # Check if the pdbhandler module is built into python.
     p = Popen((sys.executable, '-X', 'pdbhandler', '-c',
                 'import pdbhandler; pdbhandler.get_handler().host'),
@@ -543,19 +662,28 @@ def attach_loop(argv):
     # Repeatedly attach to the process using the '-X' python option or gdb.
     ctx = Context()
     error = None
+    # Give time to the process to start and register the signal handler.
     time.sleep(.5 + random.random())
+    duration = None
     while not error and proc.poll() is None:
+        start = time.time()
         if use_xoption:
             os.kill(proc.pid, signal.SIGUSR2)
             connections = {}
-            dev_null = io.StringIO() if PY3 else StringIO.StringIO()
-            asock = AttachSocketWithDetach(connections, stdout=dev_null)
+            asock = AttachSocketWithDetach(connections, stdout=_DEV_NULL)
             asock.create_socket(socket.AF_INET, socket.SOCK_STREAM)
             connect_process(asock, ctx, proc)
             asyncore.loop(map=connections)
         else:
             error = spawn_gdb(proc.pid, ctx=ctx, proc_iut=proc)
-        time.sleep(random.random())
+
+        # Sleep twice the moving average of the attach cycle duration, within
+        # 50 and 500 msecs, with some jitter.
+        elapsed = time.time() - start
+        duration = (elapsed if duration is None else
+                    0.9 * duration + 0.1 * elapsed)
+        delay = min(0.5, max(0.05, 2 * duration))
+        time.sleep(delay * (0.8 + 0.4 * random.random()))
 
     if error and gdb_terminated(error):
         error = None
@@ -604,6 +732,8 @@ with the remainder of the command line arguments and repeatedly attach
 """
 
 def main():
+    import argparse
+
     GDB = 'gdb'
 
     if len(sys.argv) > 2 and sys.argv[1] in ('-t', '--test'):
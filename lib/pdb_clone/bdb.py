@@ -11,6 +11,7 @@ except ImportError:
     import repr as reprlib   # Python 2
 
 import fnmatch
+import re
 import sys
 import os
 import linecache
@@ -23,7 +24,7 @@ from bisect import bisect
 from operator import attrgetter
 from inspect import CO_GENERATOR
 
-from . import PY3, PY34, eval_
+from . import PY3, PY34, PY36
 try:
     from . import _bdb
 except ImportError:
@@ -31,6 +32,10 @@ except ImportError:
 
 __all__ = ["BdbQuit", "Bdb", "Breakpoint"]
 
+# A sentinel for the '__return__' lookup in format_stack_entry() since the
+# return value may be None.
+_NO_RETURN = object()
+
 class ModuleFinder(list):
     """A list of the parent module names imported by the debuggee."""
 
@@ -61,18 +66,18 @@ class ModuleFinder(list):
             sys.path.insert(0, self.PATH_ENTRY)
             return
 
-        for modname in self:
-            if modname in sys.modules:
-                del sys.modules[modname]
-                submods = []
-                for subm in sys.modules:
-                    if subm.startswith(modname + '.'):
-                        submods.append(subm)
-                # All submodules of modname may not have been imported by the
-                # debuggee, but they are still removed from sys.modules as
-                # there is no way to distinguish them.
-                for subm in submods:
-                    del sys.modules[subm]
+        parents = set(modname for modname in self if modname in sys.modules)
+        if parents:
+            # All submodules of a parent module may not have been imported by
+            # the debuggee, but they are still removed from sys.modules as
+            # there is no way to distinguish them.
+            for modname in list(sys.modules):
+                name = modname
+                while name:
+                    if name in parents:
+                        del sys.modules[modname]
+                        break
+                    name = name.rpartition('.')[0]
         self[:] = []
 
     def close(self):
@@ -107,51 +112,130 @@ _modules = {}
 _module_finder = ModuleFinder()
 _casesensitive_fs = case_sensitive_file_system()
 
+# The case normalization of path names, specialized once for this file system.
+if _casesensitive_fs:
+    _normcase = os.path.normcase
+else:
+    def _normcase(pathname):
+        # On Mac OS X, normcase does not convert the path to lower case.
+        return os.path.normcase(pathname).lower()
+
+# The path names used as keys of the breakpoints dictionary are interned, so
+# that looking up an interned co_filename only needs an identity check.
+if PY3:
+    _intern = sys.intern
+else:
+    def _intern(pathname):
+        # The intern() builtin does not accept unicode strings.
+        if isinstance(pathname, str):
+            return intern(pathname)
+        return pathname
+
 def all_pathnames(abspath):
     yield abspath
-    cwd = os.getcwd()
-    if not _casesensitive_fs:
-        cwd = cwd.lower()
+    cwd = _normcase(os.getcwd())
     if abspath.startswith(cwd):
         relpath = abspath[len(cwd):]
         if relpath.startswith(os.sep):
             relpath = relpath[len(os.sep):]
+        # Both relative path names name the same file.
         if os.path.isfile(relpath):
             yield relpath
-        relpath = os.path.join('.', relpath)
-        if os.path.isfile(relpath):
-            yield relpath
+            yield os.path.join('.', relpath)
+
+# A dictionary mapping a filename to its canonical form, cleared on restart.
+_canonic_cache = {}
 
 def canonic(filename):
     if filename[:1] + filename[-1:] == '<>':
         return filename
-    pathname = os.path.normcase(os.path.abspath(filename))
-    # On Mac OS X, normcase does not convert the path to lower case.
-    if not _casesensitive_fs:
-        pathname = pathname.lower()
+    pathname = _canonic_cache.get(filename)
+    if pathname is None:
+        pathname = _intern(_normcase(os.path.abspath(filename)))
+        _canonic_cache[filename] = pathname
     return pathname
 
-def code_line_numbers(code):
-    # Source code line numbers generator (see Objects/lnotab_notes.txt).
-    valid_lno = lno = code.co_firstlineno
-    yield valid_lno
-    # The iterator yields (line_incr[i], byte_incr[i+1]) from lnotab.
-    for line_incr, byte_incr in itertools.islice(zip(code.co_lnotab,
-                itertools.chain(code.co_lnotab[1:], [b'\x01'])), 1, None, 2):
-        if PY3:
+if hasattr(types.CodeType, 'co_lines'):
+    # Python 3.10 or newer.
+    def code_line_numbers(code):
+        # Source code line numbers generator (see PEP 626).
+        valid_lno = code.co_firstlineno
+        yield valid_lno
+        for start, end, lno in code.co_lines():
+            if lno is not None and lno != valid_lno:
+                valid_lno = lno
+                yield valid_lno
+
+else:
+    def code_line_numbers(code):
+        # Source code line numbers generator (see Objects/lnotab_notes.txt).
+        valid_lno = lno = code.co_firstlineno
+        yield valid_lno
+        lnotab = bytearray(code.co_lnotab)
+        size = len(lnotab)
+        for i in range(1, size, 2):
+            line_incr = lnotab[i]
+            # The line increments are signed since Python 3.6.
+            if PY36 and line_incr >= 0x80:
+                line_incr -= 0x100
             lno += line_incr
-            if byte_incr == 0:
-                continue
-        else:
-            lno += ord(line_incr)
-            if ord(byte_incr) == 0:
+            # A null byte increment in the next entry means that the line
+            # increment continues in that entry.
+            if i + 1 < size and lnotab[i+1] == 0:
                 continue
-        if lno != valid_lno:
-            valid_lno = lno
-            yield valid_lno
+            if lno != valid_lno:
+                valid_lno = lno
+                yield valid_lno
+
+# The C implementation of code_line_numbers() returns a list.
+_code_line_numbers = (_bdb.code_line_numbers if _bdb else code_line_numbers)
+
+def code_tree(code, module_level=False):
+    """The tree of the statement line numbers of code and its subcodes.
+
+    Return the tuple (code firstlineno, sorted statement line numbers, sorted
+    subcodes first line numbers, dictionary mapping a subcode first line
+    number to the tree of the subcode).
+    """
+    subcodes = dict((c.co_firstlineno, code_tree(c)) for c in code.co_consts
+                        if isinstance(c, types.CodeType) and not
+                            c.co_name.startswith('<'))
+    code_lnos = sorted(_code_line_numbers(code))
+    # Do not stop at execution of function definitions.
+    if not module_level and len(code_lnos) > 1:
+        code_lnos = code_lnos[1:]
+    return code.co_firstlineno, code_lnos, sorted(subcodes), subcodes
+
+# A dictionary mapping the builtin scalar types to the name of the
+# reprlib.Repr attribute that limits the size of their repr().
+if PY3:
+    _scalar_repr_limits = {int: 'maxlong', str: 'maxstring',
+            float: 'maxother', bool: 'maxother', type(None): 'maxother'}
+else:
+    _scalar_repr_limits = {long: 'maxlong', str: 'maxstring',
+            int: 'maxother', float: 'maxother', bool: 'maxother',
+            type(None): 'maxother'}
 
 def safe_repr(obj):
     try:
+        # The repr() of a builtin scalar is returned as is by reprlib when it
+        # is not longer than its limit.
+        limit = _scalar_repr_limits.get(type(obj))
+        if limit:
+            maxlen = getattr(reprlib.aRepr, limit)
+            # Do not build the repr() of a long string or of a large integer
+            # only to find out that it is too long: each decimal digit of an
+            # integer is worth more than three bits.
+            if limit == 'maxstring':
+                small = len(obj) <= maxlen
+            elif limit == 'maxlong':
+                small = obj.bit_length() <= 4 * maxlen
+            else:
+                small = True
+            if small:
+                s = repr(obj)
+                if len(s) <= maxlen:
+                    return s
         return reprlib.repr(obj)
     except Exception:
         return object.__repr__(obj)
@@ -199,16 +283,17 @@ class IntegersCache:
             self.refs[i] -= 1
             if not self.refs[i]:
                 self.cache[i] = None
-                # Pack the end of the list.
+                # Pack the end of the list in place, the list object is
+                # referenced by the _bdb.BdbTracer instance.
                 if i == self.len - 1:
                     for j in range(i, -1, -1):
                         if self.cache[j] is not None:
                             break
                     else:
                         j = -1
-                    self.cache[:] = self.cache[:j-i]
-                    self.refs[:] = self.refs[:j-i]
-                    self.len -= i - j
+                    del self.cache[j+1:]
+                    del self.refs[j+1:]
+                    self.len = j + 1
             return i
         return None
 
@@ -221,6 +306,9 @@ class BdbModule:
     Instance attributes:
         functions_firstlno: a dictionary mapping function names and fully
         qualified method names to their first line number.
+        code_tree: the code_tree() of the module code object.
+        actual_bps: a dictionary mapping a line number to the result of
+        get_actual_bp(), None when there is no valid statement.
     """
 
     def __init__(self, filename):
@@ -233,15 +321,19 @@ class BdbModule:
                 id(linecache.cache[self.filename]) != id(self.linecache)):
             self.functions_firstlno = None
             self.code = None
+            self.code_tree = None
+            self.actual_bps = {}
+            self.source = None
             lines = ''.join(linecache.getlines(self.filename))
             if not lines:
                 raise BdbSourceError('No lines in {}.'.format(self.filename))
             try:
                 self.code = compile(lines, self.filename, 'exec', 0, True)
-                self.node = compile(lines, self.filename, 'exec',
-                                                    ast.PyCF_ONLY_AST, True)
             except (SyntaxError, TypeError) as err:
                 raise BdbSyntaxError('{}: {}.'.format(self.filename, err))
+            # The source is parsed into an ast only when needed by
+            # get_func_lno().
+            self.source = lines
             # At this point we still need to test for self.filename in
             # linecache.cache because of doctest scripts, as doctest installs a
             # hook at linecache.getlines to allow <doctest name> to be
@@ -276,8 +368,15 @@ class BdbModule:
                 yield name, node.lineno
 
         if self.functions_firstlno is None:
+            if self.source is None:
+                # The last reset() failed to read or to compile the source.
+                raise BdbSourceError('{}: cannot parse the source.'.format(
+                    self.filename))
+            node = compile(self.source, self.filename, 'exec',
+                                                ast.PyCF_ONLY_AST, True)
+            self.source = None
             self.functions_firstlno = {}
-            for name, lineno in FuncLineno().visit(self.node):
+            for name, lineno in FuncLineno().visit(node):
                 if (name not in self.functions_firstlno or
                         self.functions_firstlno[name] < lineno):
                     self.functions_firstlno[name] = lineno
@@ -300,17 +399,14 @@ class BdbModule:
         line number of a subcode, use its first statement line instead.
         """
 
-        def _distance(code, module_level=False):
+        def _distance(tree):
             """The shortest distance to the next valid statement."""
-            subcodes = dict((c.co_firstlineno, c) for c in code.co_consts
-                                if isinstance(c, types.CodeType) and not
-                                    c.co_name.startswith('<'))
+            firstlineno, code_lnos, subcodes_flnos, subcodes = tree
             # Get the shortest distance to the subcode whose first line number
             # is the last to be less or equal to lineno. That is, find the
             # index of the first subcode whose first_lno is the first to be
             # strictly greater than lineno.
             subcode_dist = None
-            subcodes_flnos = sorted(subcodes)
             idx = bisect(subcodes_flnos, lineno)
             if idx != 0:
                 flno = subcodes_flnos[idx-1]
@@ -318,15 +414,12 @@ class BdbModule:
 
             # Check if lineno is a valid statement line number in the current
             # code, excluding function or method definition lines.
-            code_lnos = sorted(code_line_numbers(code))
-            # Do not stop at execution of function definitions.
-            if not module_level and len(code_lnos) > 1:
-                code_lnos = code_lnos[1:]
-            if lineno in code_lnos and lineno not in subcodes_flnos:
-                return 0, (code.co_firstlineno, lineno)
+            idx = bisect(code_lnos, lineno)
+            if (idx != 0 and code_lnos[idx-1] == lineno and
+                    lineno not in subcodes):
+                return 0, (firstlineno, lineno)
 
             # Compute the distance to the next valid statement in this code.
-            idx = bisect(code_lnos, lineno)
             if idx == len(code_lnos):
                 # lineno is greater that all 'code' line numbers.
                 return subcode_dist
@@ -334,19 +427,30 @@ class BdbModule:
             dist = actual_lno - lineno
             if subcode_dist and subcode_dist[0] < dist:
                 return subcode_dist
-            if actual_lno not in subcodes_flnos:
-                return dist, (code.co_firstlineno, actual_lno)
+            if actual_lno not in subcodes:
+                return dist, (firstlineno, actual_lno)
             else:
                 # The actual line number is the line number of the first
                 # statement of the subcode following lineno (recursively).
                 return _distance(subcodes[actual_lno])
 
-        if self.code:
-            code_dist = _distance(self.code, module_level=True)
-        if not self.code or not code_dist:
+        # The result only depends on the source code, the cache is cleared by
+        # reset() when the source code has changed.
+        try:
+            actual_bp = self.actual_bps[lineno]
+        except KeyError:
+            actual_bp = None
+            if self.code:
+                if self.code_tree is None:
+                    self.code_tree = code_tree(self.code, module_level=True)
+                code_dist = _distance(self.code_tree)
+                if code_dist:
+                    actual_bp = code_dist[1]
+            self.actual_bps[lineno] = actual_bp
+        if actual_bp is None:
             raise BdbSourceError('{}: line {} is after the last '
                 'valid statement.'.format(self.filename, lineno))
-        return code_dist[1]
+        return actual_bp
 
 class ModuleBreakpoints(dict):
     """The breakpoints of a module.
@@ -366,6 +470,8 @@ class ModuleBreakpoints(dict):
             _modules[filename] = BdbModule(filename)
         self.bdb_module = _modules[filename]
         self.lineno_cache = lineno_cache
+        # The number of breakpoints.
+        self.bp_count = 0
 
     def reset(self):
         try:
@@ -375,6 +481,7 @@ class ModuleBreakpoints(dict):
         if do_reset:
             bplist = self.all_breakpoints()
             self.clear()
+            self.bp_count = 0
             for bp in bplist:
                 try:
                     bp.actual_bp = self.add_breakpoint(bp)
@@ -391,6 +498,7 @@ class ModuleBreakpoints(dict):
             code_bps[actual_lno] = []
             self.lineno_cache.add(actual_lno)
         code_bps[actual_lno].append(bp)
+        self.bp_count += 1
         return firstlineno, actual_lno
 
     def delete_breakpoint(self, bp):
@@ -403,6 +511,7 @@ class ModuleBreakpoints(dict):
             # This may occur after a reset and the breakpoint could not be
             # added anymore.
             return
+        self.bp_count -= 1
         if not bplist:
             del code_bps[actual_lno]
             self.lineno_cache.delete(actual_lno)
@@ -414,6 +523,14 @@ class ModuleBreakpoints(dict):
             # code_bps.
             pass
 
+    def delete_all_breakpoints(self):
+        for code_bps in self.values():
+            for actual_lno in code_bps:
+                self.lineno_cache.delete(actual_lno)
+            # DO NOT delete the code_bps dictionary, see delete_breakpoint().
+            code_bps.clear()
+        self.bp_count = 0
+
     def get_breakpoints(self, lineno):
         """Return the list of breakpoints set at lineno."""
         try:
@@ -464,6 +581,13 @@ class Tracer:
         self.breakpoints = {}
         # The list of line numbers used to improve _bdb performance.
         self.linenumbers = []
+        # A dictionary mapping a co_filename to its lower case.
+        self._lcfilename_cache = {}
+        # The code object and the ModuleBreakpoints instance found by the
+        # last successful bkpt_in_code(), used by bkpt_at_line() when tracing
+        # lines in the same function.
+        self._f_code = None
+        self._module_bps = None
         self.reset()
 
     def reset(self, ignore_first_call_event=True, botframe=None):
@@ -476,12 +600,28 @@ class Tracer:
         self.stop_lineno = 0
 
     def trace_dispatch(self, frame, event, arg):
+        # The stopframe and stop_lineno tests of stop_here() are done inline
+        # to avoid a method call on each event when the debugger does not
+        # stop, for example after a 'continue' command.
+        stopframe = self.stopframe
         if event == 'line':
-            if self.stop_here(frame):
+            if ((stopframe is None or stopframe is frame) and
+                    self.stop_lineno != -1 and self.stop_here(frame)):
                 return self.user_method(frame, self.user_line)
             module_bps = self.bkpt_at_line(frame)
             if module_bps:
                 return self.user_method(frame, self.bkpt_user_line, module_bps)
+            # After a 'continue' command, stop tracing a frame whose trace
+            # function had been set while stepping, when there is no
+            # breakpoint in its code. As for the frames that have not been
+            # traced, the trace function is set again in the caller of the
+            # frame returning after a step, next, until or return command.
+            if (stopframe is None and self.stop_lineno == -1 and
+                    frame.f_code is not self._f_code and
+                    frame is not self.botframe and
+                    not self.bkpt_in_code(frame)):
+                frame.f_trace = None
+                return None
             return self.trace_dispatch
 
         elif event == 'call':
@@ -490,20 +630,21 @@ class Tracer:
                 return self.trace_dispatch
             if frame.f_code in self.skip_calls:
                 return # None
-            stop_here = self.stop_here(frame)
+            stop_here = ((stopframe is None or stopframe is frame) and
+                    self.stop_lineno != -1 and self.stop_here(frame))
             if not (stop_here or self.bkpt_in_code(frame)):
                 # When frame is stopframe, we are re-entering a generator
                 # frame where the {next, until, return} command had been
                 # previously issued, so we need to enable tracing in this
                 # function.
-                if (PY34 and self.stopframe is frame and
+                if (PY34 and stopframe is frame and
                         frame.f_code.co_flags & CO_GENERATOR):
                     return self.trace_dispatch
                 # No need to trace this function.
                 return # None
             # Ignore call events in generator except when stepping.
             if (PY34 and frame.f_code.co_flags & CO_GENERATOR and
-                    (self.stopframe is not None or self.stop_lineno != 0)):
+                    (stopframe is not None or self.stop_lineno != 0)):
                 return self.trace_dispatch
             if stop_here:
                 return self.user_method(frame, self.user_call, arg)
@@ -511,7 +652,8 @@ class Tracer:
             return self.trace_dispatch
 
         elif event == 'return':
-            if self.stop_here(frame) or frame is self.stopframe:
+            if (frame is stopframe or (stopframe is None and
+                    self.stop_lineno != -1 and self.stop_here(frame))):
                 # Ignore return events in generator except when stepping.
                 if PY34:
                     ignore = (frame.f_code.co_flags & CO_GENERATOR and
@@ -526,8 +668,9 @@ class Tracer:
                 if (frame is not self.botframe and
                         ((self.stopframe is None and self.stop_lineno == 0) or
                                         frame is self.stopframe)):
-                    if frame.f_back and not frame.f_back.f_trace:
-                        frame.f_back.f_trace = self.trace_dispatch
+                    caller = frame.f_back
+                    if caller and not caller.f_trace:
+                        caller.f_trace = self.trace_dispatch
                     if not ignore:
                         self.stopframe = None
                         self.stop_lineno = 0
@@ -559,30 +702,47 @@ class Tracer:
             return self.trace_dispatch
 
     def stop_here(self, frame):
-        if self.skip_modules and self.is_skipped_module(frame):
-            return False
         if frame is self.stopframe or self.stopframe is None:
             if self.stop_lineno == -1:
                 return False
-            return frame.f_lineno >= self.stop_lineno
+            # Check the skipped modules last, as this is the most expensive.
+            return (frame.f_lineno >= self.stop_lineno and
+                not (self.skip_modules and self.is_skipped_module(frame)))
+        return False
 
     def bkpt_at_line(self, frame):
-        filename = (frame.f_code.co_filename if not self.to_lowercase
-                    else frame.f_code.co_filename.lower())
-        if filename not in self.breakpoints:
+        # Most lines are not breakpoint lines: reject them with the line
+        # numbers list before the breakpoints dictionaries lookups.
+        lineno = frame.f_lineno
+        if lineno >= len(self.linenumbers) or self.linenumbers[lineno] is None:
             return # None
-        module_bps = self.breakpoints[filename]
-        firstlineno = frame.f_code.co_firstlineno
-        if (firstlineno in module_bps and
-                frame.f_lineno in module_bps[firstlineno]):
+        if frame.f_code is self._f_code:
+            module_bps = self._module_bps
+        else:
+            module_bps = self.bkpt_in_code(frame)
+            if module_bps is None:
+                return # None
+        if lineno in module_bps.get(frame.f_code.co_firstlineno, ()):
             return module_bps
 
     def bkpt_in_code(self, frame):
-        filename = (frame.f_code.co_filename if not self.to_lowercase
-                    else frame.f_code.co_filename.lower())
-        if (filename in self.breakpoints and
-                frame.f_code.co_firstlineno in self.breakpoints[filename]):
-            return True
+        code = frame.f_code
+        firstlineno = code.co_firstlineno
+        if (firstlineno >= len(self.linenumbers) or
+                self.linenumbers[firstlineno] is None):
+            return # None
+        filename = code.co_filename
+        if self.to_lowercase:
+            lc_filename = self._lcfilename_cache.get(filename)
+            if lc_filename is None:
+                lc_filename = _intern(filename.lower())
+                self._lcfilename_cache[filename] = lc_filename
+            filename = lc_filename
+        module_bps = self.breakpoints.get(filename)
+        if module_bps is not None and firstlineno in module_bps:
+            self._f_code = code
+            self._module_bps = module_bps
+            return module_bps
 
     def settrace(self, do_set):
         """Set or remove the trace function."""
@@ -623,6 +783,15 @@ class Bdb(BdbTracer):
                       ModuleFinder.find_module.__code__)
         BdbTracer.__init__(self, not _casesensitive_fs, skip_modules, skip_calls)
         self.lineno_cache = IntegersCache(self.linenumbers)
+        # The skip patterns as a single regular expression.
+        self.skip_re = None
+        if skip_modules:
+            self.skip_re = re.compile('|'.join('(?:%s)' %
+                    fnmatch.translate(os.path.normcase(pattern))
+                    for pattern in skip_modules))
+        # A dictionary mapping a module name to the result of
+        # is_skipped_module().
+        self.skipped_modules = {}
 
     # Backward compatibility.
     def canonic(self, filename):
@@ -631,6 +800,7 @@ class Bdb(BdbTracer):
     def restart(self):
         """Restart the debugger after source code changes."""
         _module_finder.reset()
+        _canonic_cache.clear()
         linecache.checkcache()
         for module_bpts in self.breakpoints.values():
             module_bpts.reset()
@@ -654,10 +824,13 @@ class Bdb(BdbTracer):
 
     def is_skipped_module(self, frame):
         module_name = frame.f_globals.get('__name__')
-        for pattern in self.skip_modules:
-            if fnmatch.fnmatch(module_name, pattern):
-                return True
-        return False
+        skipped = self.skipped_modules.get(module_name)
+        if skipped is None:
+            # Same as fnmatch.fnmatch() with each one of the patterns.
+            skipped = bool(self.skip_re and
+                           self.skip_re.match(os.path.normcase(module_name)))
+            self.skipped_modules[module_name] = skipped
+        return skipped
 
     def _set_stopinfo(self, stopframe, stop_lineno):
         # Ensure that stopframe belongs to the stack frame in the interval
@@ -828,21 +1001,22 @@ class Bdb(BdbTracer):
         if funcname:
             lineno = module_bps.bdb_module.get_func_lno(funcname)
         bp = Breakpoint(filename, lineno, module_bps, temporary, cond)
-        filename_paths = list(all_pathnames(filename))
+        filename_paths = frozenset(all_pathnames(filename))
         if filename not in self.breakpoints:
             # self.breakpoints dictionary maps also the relative path names to
             # the common ModuleBreakpoints instance (co_filename may be a
             # relative path name).
             for pathname in filename_paths:
-                self.breakpoints[pathname] = module_bps
+                self.breakpoints[_intern(pathname)] = module_bps
 
         # Set the trace function when the breakpoint is set in one of the
         # frames of the frame stack.
         firstlineno, actual_lno = bp.actual_bp
         frame = self.topframe
         while frame:
-            if (frame.f_code.co_filename in filename_paths and
-                        firstlineno == frame.f_code.co_firstlineno):
+            code = frame.f_code
+            if (firstlineno == code.co_firstlineno and
+                        code.co_filename in filename_paths):
                 if not frame.f_trace:
                     frame.f_trace = self.trace_dispatch
             if frame is self.botframe:
@@ -868,9 +1042,14 @@ class Bdb(BdbTracer):
     def clear_all_breaks(self):
         if not self.has_breaks():
             return 'There are no breakpoints'
+        # Delete the breakpoints of each ModuleBreakpoints instance at once.
+        modules = {}
         for bp in Breakpoint.bpbynumber:
             if bp:
-                bp.deleteMe()
+                Breakpoint.bpbynumber[bp.number] = None
+                modules[id(bp.module)] = bp.module
+        for module_bps in modules.values():
+            module_bps.delete_all_breakpoints()
 
     def get_bpbynumber(self, arg):
         if not arg:
@@ -888,42 +1067,42 @@ class Bdb(BdbTracer):
         return bp
 
     def get_breaks(self, filename, lineno):
-        filename = canonic(filename)
-        if filename in self.breakpoints:
-            return self.breakpoints[filename].get_breakpoints(lineno)
+        module_bps = self.breakpoints.get(canonic(filename))
+        if module_bps is not None:
+            return module_bps.get_breakpoints(lineno)
         return []
 
     def get_file_breaks(self, filename):
-        filename = canonic(filename)
-        if filename not in self.breakpoints:
+        module_bps = self.breakpoints.get(canonic(filename))
+        if module_bps is None:
             return []
-        return [bp.line for bp in self.breakpoints[filename].all_breakpoints()]
+        return [bp.line for bp in module_bps.all_breakpoints()]
 
     def has_breaks(self):
-        # A code_bps dictionary b[f][l] may be empty and does not have empty
-        # bplist values, see ModuleBreakpoints.delete_breakpoint().
-        b = self.breakpoints
-        return any(list(b[f][l].values()) for f in b for l in b[f])
+        return any(module_bps.bp_count
+                   for module_bps in self.breakpoints.values())
 
     # Derived classes and clients can call the following method
     # to get a data structure representing a stack trace.
 
     def get_stack(self, f, t):
         stack = []
+        append = stack.append
+        botframe = self.botframe
         if t and t.tb_frame is f:
             t = t.tb_next
-        elif self.botframe:
-            while t and not t.tb_frame is self.botframe:
+        elif botframe:
+            while t and t.tb_frame is not botframe:
                 t = t.tb_next
         while f is not None:
-            stack.append((f, f.f_lineno))
-            if f is self.botframe:
+            append((f, f.f_lineno))
+            if f is botframe:
                 break
             f = f.f_back
         stack.reverse()
         i = max(0, len(stack) - 1)
         while t is not None:
-            stack.append((t.tb_frame, t.tb_lineno))
+            append((t.tb_frame, t.tb_lineno))
             t = t.tb_next
         if f is None:
             i = max(0, len(stack) - 1)
@@ -938,16 +1117,13 @@ class Bdb(BdbTracer):
         else:
             s += "<lambda>"
         locals = self.get_locals(frame)
-        if '__args__' in locals:
-            args = locals['__args__']
-        else:
-            args = None
+        args = locals.get('__args__')
         if args:
             s += safe_repr(args)
         else:
             s += '()'
-        if '__return__' in locals:
-            rv = locals['__return__']
+        rv = locals.get('__return__', _NO_RETURN)
+        if rv is not _NO_RETURN:
             s += '->'
             s += safe_repr(rv)
         line = linecache.getline(filename, lineno, frame.f_globals)
@@ -1019,7 +1195,7 @@ def set_trace():
     Bdb().set_trace()
 
 
-class Breakpoint:
+class Breakpoint(object):
     """Breakpoint class.
 
     Implements temporary breakpoints, ignore counts, disabling and
@@ -1029,6 +1205,10 @@ class Breakpoint:
 
     """
 
+    __slots__ = ('file', 'line', 'module', 'actual_bp', 'temporary', 'cond',
+                 '_cond_source', '_cond_code', 'enabled', 'ignore', 'hits',
+                 'number')
+
     next = 1        # Next bp to be assigned
     bpbynumber = [None] # Each entry is None or an instance of Bpt
 
@@ -1040,6 +1220,11 @@ class Breakpoint:
         self.actual_bp = module.add_breakpoint(self)
         self.temporary = temporary
         self.cond = cond
+        # The code object compiled from the 'cond' string. 'cond' may be set
+        # directly by the clients, so the code is compiled at the first hit
+        # after each change.
+        self._cond_source = None
+        self._cond_code = None
         self.enabled = True
         self.ignore = 0
         self.hits = 0
@@ -1067,7 +1252,17 @@ class Breakpoint:
         # A conditional breakpoint.
         if self.cond:
             try:
-                if not eval_(self.cond, frame.f_globals, frame.f_locals):
+                if self.cond is not self._cond_source:
+                    # Prepare the source as the eval() builtin does on Python
+                    # 3 and eval_() on Python 2.
+                    if PY3:
+                        source = self.cond.lstrip(' \t')
+                    else:
+                        source = self.cond + '\n'
+                    self._cond_code = compile(source, '<string>', 'eval',
+                                                                0, True)
+                    self._cond_source = self.cond
+                if not eval(self._cond_code, frame.f_globals, frame.f_locals):
                     return False, False
             except Exception:
                 # If the breakpoint condition evaluation fails, the most
@@ -11,13 +11,11 @@ at.
 # NOTE: some gdbs are linked with Python 3, so this file should be dual-syntax
 # compatible (2.7+ and 3+).
 
+# The modules only used by the py-pdb command are imported by the functions
+# that use them, to speed up the loading of this file by gdb.
 import os
 import sys
-import subprocess
 import re
-import tempfile
-import socket
-import traceback
 import gdb
 try:
     from libpython import Frame
@@ -34,40 +32,53 @@ class PdbFatalError(Exception):
     """Fatal error in the py-pdb command."""
 
 def already_in_use(addr):
+    import socket
     s = None
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind(addr)
-    except Exception:
-        raise PdbLocalError('%s: %s' % sys.exc_info()[:2])
+    except Exception as err:
+        raise PdbLocalError('%s: %s' % (type(err), err))
     finally:
         if s:
             s.close()
 
 def gdb_execute(command):
     rv = gdb.execute(command, False, True)
-    if rv and len(rv.split('=')) == 2:
-        return rv.split('=')[1].strip()
+    if rv:
+        fields = rv.split('=')
+        if len(fields) == 2:
+            return fields[1].strip()
     return None
 
+# The (program, symbol) tuples found by is_symbol(). A missing symbol is not
+# cached as it may be defined later by a shared library loaded by the inferior.
+_symbols = set()
+
 def is_symbol(symbol):
-    re_symbol = re.compile(r'^\s*0x[0-9A-Fa-f]+\s*%s\s*$' % symbol)
+    key = (gdb.progspaces()[0].filename, symbol)
+    if key in _symbols:
+        return True
+    # Match the lines of the output with '[^\S\n]', a white space that is not
+    # a new line.
+    re_symbol = re.compile(r'^[^\S\n]*0x[0-9A-Fa-f]+[^\S\n]*%s[^\S\n]*$' %
+                                                re.escape(symbol), re.MULTILINE)
     txt = gdb.execute('info functions ^%s$' % symbol, False, True)
-    for line in txt.split('\n'):
-        if re_symbol.match(line):
-            return True
+    if re_symbol.search(txt):
+        _symbols.add(key)
+        return True
     return False
 
 def module_fname(module):
+    import subprocess
     inferior = gdb.progspaces()[0].filename
     try:
         proc = subprocess.Popen([inferior, '-c',
                         'import %(m)s; print(%(m)s.__file__)' % {'m':module}],
                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except OSError:
-        raise PdbFatalError('module_fname: %s: %s' %
-                                            (sys.exc_info()[1], inferior))
+    except OSError as err:
+        raise PdbFatalError('module_fname: %s: %s' % (err, inferior))
     else:
         out, err = proc.communicate()
         if proc.returncode == 0:
@@ -111,7 +122,16 @@ int main() {
 }
 """
 
+# A dictionary mapping a dlfcn flag name to its value.
+_dlopen_flags = {}
+
 def dlopen_flag(flag):
+    """Return the value of the dlfcn flag, computed once per gdb session."""
+    if flag not in _dlopen_flags:
+        _dlopen_flags[flag] = _dlopen_flag(flag)
+    return _dlopen_flags[flag]
+
+def _dlopen_flag(flag):
     if os.name != 'posix':
         return
 
@@ -119,6 +139,8 @@ def dlopen_flag(flag):
     if hasattr(os, flag):
         return int(getattr(os, flag))
 
+    import subprocess
+    import tempfile
     f = tempfile.NamedTemporaryFile()
     a_out = f.name
     f.close()
@@ -138,16 +160,16 @@ def dlopen_flag(flag):
         try:
             proc = subprocess.Popen([a_out],
                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except OSError:
-            raise PdbFatalError('%s: %s' % (sys.exc_info()[1], 'dlfcn'))
+        except OSError as err:
+            raise PdbFatalError('%s: %s' % (err, 'dlfcn'))
         else:
             value, err = proc.communicate()
             if proc.returncode != 0:
                 raise PdbFatalError(err.strip())
             try:
                 return int(value)
-            except ValueError:
-                raise PdbFatalError('%s: %s' % (sys.exc_info()[1], value))
+            except ValueError as err:
+                raise PdbFatalError('%s: %s' % (err, value))
     finally:
         try:
             os.unlink(a_out)
@@ -163,6 +185,23 @@ else:
                 "load_dynamic('%s', '%s')\")")
     LOADDYNAMIC = '_PyImport_GetDynLoadFunc'
 
+# The frames where it is not safe to setup pdb.
+UNSAFE_FRAMES = {
+    'Py_Initialize': 'Interpreter not yet initialized.',
+    'Py_Finalize': 'Interpreter is being finalized.',
+    'Py_NewInterpreter': 'A subinterpreter is being initialized.',
+    'Py_MakePendingCalls': 'A signal is being processed.',
+    'Py_AddPendingCall': 'A signal is being processed.',
+}
+
+# The frames that prevent the use of one of the loaders.
+IN_DLOPEN = 1
+IN_LOAD_DYNAMIC = 2
+LOADER_FRAMES = {
+    'dlopen': IN_DLOPEN,
+    LOADDYNAMIC: IN_LOAD_DYNAMIC,
+}
+
 class PyPdb(gdb.Command):
     """Setup pdb for remote debugging."""
     def __init__(self):
@@ -172,16 +211,14 @@ class PyPdb(gdb.Command):
     def invoke(self, arg, from_tty):
         try:
             self._invoke(arg)
-        except PdbLocalError:
-            print('Cannot setup pdb for remote debugging.\n%s'
-                                        % sys.exc_info()[1])
-        except PdbFatalError:
-            print('Unable to setup pdb for remote debugging.\n%s'
-                                        % sys.exc_info()[1])
-        except Exception:
+        except PdbLocalError as err:
+            print('Cannot setup pdb for remote debugging.\n%s' % err)
+        except PdbFatalError as err:
+            print('Unable to setup pdb for remote debugging.\n%s' % err)
+        except Exception as err:
+            import traceback
             traceback.print_exc()
-            print('Cannot setup pdb for remote debugging.\n%s'
-                                        % sys.exc_info()[1])
+            print('Cannot setup pdb for remote debugging.\n%s' % err)
         finally:
             self.dont_repeat()
 
@@ -208,22 +245,13 @@ class PyPdb(gdb.Command):
             raise PdbLocalError(
                     'Refusing to attach at the previous pdb subinterpreter.')
 
-        in_dlopen = in_load_dynamic = False
+        in_frames = 0
         f = gdb.newest_frame()
         while f:
             name = f.name()
-            if name == 'Py_Initialize':
-                raise PdbLocalError('Interpreter not yet initialized.')
-            elif name == 'Py_Finalize':
-                raise PdbLocalError('Interpreter is being finalized.')
-            elif name == 'Py_NewInterpreter':
-                raise PdbLocalError('A subinterpreter is being initialized.')
-            elif name == 'Py_MakePendingCalls' or name == 'Py_AddPendingCall':
-                raise PdbLocalError('A signal is being processed.')
-            elif name == 'dlopen':
-                in_dlopen = True
-            elif name == LOADDYNAMIC:
-                in_load_dynamic = True
+            if name in UNSAFE_FRAMES:
+                raise PdbLocalError(UNSAFE_FRAMES[name])
+            in_frames |= LOADER_FRAMES.get(name, 0)
             f = f.older()
 
         loader = ''
@@ -234,7 +262,7 @@ class PyPdb(gdb.Command):
 
             # Try first dlopen on unix.
             if os.name == 'posix' and is_symbol('dlopen'):
-                if in_dlopen:
+                if in_frames & IN_DLOPEN:
                     raise PdbLocalError('Stopped within dlopen.')
                 flag = dlopen_flag('RTLD_NOW')
                 if (isinstance(flag, int) and
@@ -250,7 +278,7 @@ class PyPdb(gdb.Command):
             # 20891: PyGILState_Ensure on non-Python thread causes fatal
             # error.
             if not loader:
-                if in_load_dynamic:
+                if in_frames & IN_LOAD_DYNAMIC:
                     raise PdbLocalError('Stopped within load_dynamic.')
                 loader = 'load_dynamic'
                 state = gdb_execute('call (int)PyGILState_Ensure()')
@@ -77,9 +77,6 @@ import re
 import sys
 import cmd
 import dis
-import code
-import glob
-import pprint
 import signal
 import errno
 import inspect
@@ -89,9 +86,6 @@ if not hasattr(importlib, 'find_loader'):
 import traceback
 import linecache
 import socket
-import readline
-import shlex
-import pydoc
 from operator import attrgetter
 
 from . import PY3, PY34, exec_, eval_, bdb
@@ -155,6 +149,9 @@ class RemoteSocket:
                 restart_call(self.server.listen, 0)
                 self.socket, _ = restart_call(self.server.accept)
                 self.socket.setblocking(True)
+                # Do not delay the small writes of the pdb output.
+                self.socket.setsockopt(
+                                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.server.close()
                 self.server = None
                 # Do not use the preferred encoding as - a) both ends of the
@@ -238,8 +235,15 @@ class RemoteSocket:
             self.server.close()
             self.server = None
 
+# A dictionary mapping a function name to the compiled regex that matches its
+# definition.
+_funcdef_res = {}
+
 def find_function(funcname, filename):
-    cre = re.compile(r'def\s+%s\s*[(]' % re.escape(funcname))
+    cre = _funcdef_res.get(funcname)
+    if cre is None:
+        cre = re.compile(r'def\s+%s\s*[(]' % re.escape(funcname))
+        _funcdef_res[funcname] = cre
     try:
         fp = open(filename)
     except IOError:
@@ -247,7 +251,8 @@ def find_function(funcname, filename):
     # consumer of this info expects the first line to be 1
     with fp:
         for lineno, line in enumerate(fp, start=1):
-            if cre.match(line):
+            # The regex is anchored at the start of the line.
+            if line.startswith('def') and cre.match(line):
                 return funcname, filename, lineno
     return None
 
@@ -264,12 +269,17 @@ def getsourcelines(obj, locals=None):
     return inspect.getblock(lines[lineno:]), lineno+1
 
 def lasti2lineno(code, lasti):
-    linestarts = list(dis.findlinestarts(code))
-    linestarts.reverse()
-    for i, lineno in linestarts:
-        if lasti >= i:
-            return lineno
-    return 0
+    # The line starts are sorted by increasing offsets.
+    lineno = 0
+    for i, start in dis.findlinestarts(code):
+        if i > lasti:
+            break
+        lineno = start
+    return lineno
+
+# A dictionary mapping the arguments of _find_module_fname() to its result,
+# cleared on restart.
+_module_fnames = {}
 
 def get_module_fname(module_name, path=None, inpackage=None):
     if module_name in sys.modules:
@@ -295,6 +305,14 @@ def get_module_fname(module_name, path=None, inpackage=None):
         search_path = path
     else:
         search_path = sys.path
+    key = (fullmodule, module_name,
+           tuple(search_path) if search_path is not None else None)
+    if key not in _module_fnames:
+        _module_fnames[key] = _find_module_fname(fullmodule, module_name,
+                                                 search_path)
+    return _module_fnames[key]
+
+def _find_module_fname(fullmodule, module_name, search_path):
     if hasattr(importlib, 'find_loader'):
         try:
             loader = importlib.find_loader(fullmodule, search_path)
@@ -331,9 +349,11 @@ def get_fqn_fname(fqn, frame):
         func = eval_(fqn, frame.f_globals)
     except Exception:
         # fqn is defined in a module not yet (fully) imported.
-        module = inspect.getmodule(frame)
+        modname = frame.f_globals.get('__name__')
+        if modname is None:
+            modname = inspect.getmodule(frame).__name__
         candidate_tuples = []
-        frame_fname = source_filename(get_module_fname(module.__name__))
+        frame_fname = source_filename(get_module_fname(modname))
         # Try first the current module for a function or method.
         if frame_fname:
             candidate_tuples.append((fqn, frame_fname))
@@ -363,6 +383,79 @@ def get_fqn_fname(fqn, frame):
                 return [(fqn, filename)]
     return []
 
+# A dictionary mapping the absolute path name of an rc file to the tuple
+# ((st_mtime, st_size), lines).
+_rcfiles = {}
+
+def _read_rcfile(pathname):
+    """Return the lines of an rc file, read again only when it has changed."""
+    try:
+        pathname = os.path.abspath(pathname)
+        st = os.stat(pathname)
+    except OSError:
+        return []
+    stamp = (st.st_mtime, st.st_size)
+    cached = _rcfiles.get(pathname)
+    if cached is None or cached[0] != stamp:
+        try:
+            with open(pathname) as rcFile:
+                cached = (stamp, list(rcFile))
+        except IOError:
+            return []
+        _rcfiles[pathname] = cached
+    return cached[1]
+
+# A dictionary mapping the file name of a script run by Pdb._runscript() to
+# the tuple ((st_mtime, st_size), code).
+_scripts = {}
+
+# The maximum number of entries of the _statements and _expressions caches.
+_code_cache_size = 256
+
+def _cache_code(cache, source, code):
+    """Store the code object of 'source' in 'cache' and return it.
+
+    The cache is emptied first when it is full.
+    """
+    if len(cache) >= _code_cache_size:
+        cache.clear()
+    cache[source] = code
+    return code
+
+# A dictionary mapping a statement run by Pdb.default() to its code object.
+_statements = {}
+
+# A dictionary mapping an expression evaluated by pdb to its code object.
+_expressions = {}
+
+def _compile_expr(expr):
+    """Return the code object of an expression, compiled only once."""
+    code = _expressions.get(expr)
+    if code is None:
+        # Prepare the source as the eval() builtin does on Python 3 and
+        # eval_() on Python 2.
+        source = expr.lstrip(' \t') if PY3 else expr + '\n'
+        code = compile(source, '<string>', 'eval', 0, True)
+        _cache_code(_expressions, expr, code)
+    return code
+
+# The key used to sort the threads listed by the 'thread' command.
+_thread_key = attrgetter('name', 'ident')
+
+# The parameters of an alias: '%1' to '%9' and '%*'. '%10' is the first
+# parameter followed by '0'.
+_alias_params = re.compile(r'%([1-9]|\*)')
+
+def _alias_param(match, args):
+    """Return the replacement of an alias parameter."""
+    param = match.group(1)
+    if param == '*':
+        return ' '.join(args[1:])
+    index = int(param)
+    if index < len(args):
+        return args[index]
+    return match.group(0)
+
 class _rstr(str):
     """String that doesn't quote its repr."""
     def __repr__(self):
@@ -397,6 +490,7 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         self.forget()
         # Try to load readline if it exists
         try:
+            import readline
             # remove some common file name delimiters
             readline.set_completer_delims(' \t\n`@#$%^&*()=+[{]}\\|;:\'",<>?')
         except ImportError:
@@ -408,16 +502,8 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         self.rcLines = []
         if 'HOME' in os.environ:
             envHome = os.environ['HOME']
-            try:
-                with open(os.path.join(envHome, ".pdbrc")) as rcFile:
-                    self.rcLines.extend(rcFile)
-            except IOError:
-                pass
-        try:
-            with open(".pdbrc") as rcFile:
-                self.rcLines.extend(rcFile)
-        except IOError:
-            pass
+            self.rcLines.extend(_read_rcfile(os.path.join(envHome, ".pdbrc")))
+        self.rcLines.extend(_read_rcfile(".pdbrc"))
 
         self.commands = {} # associates a command list to breakpoint numbers
         self.commands_doprompt = {} # for each bp num, tells if the prompt
@@ -465,6 +551,10 @@ class Pdb(bdb.Bdb, cmd.Cmd):
                             ' this non-main thread cannot be interrupted.')
                     self.close()
 
+    def restart(self):
+        _module_fnames.clear()
+        bdb.Bdb.restart(self)
+
     def forget(self):
         self.lineno = None
         self.stack = []
@@ -492,17 +582,16 @@ class Pdb(bdb.Bdb, cmd.Cmd):
             return
         # local copy because of recursion
         rcLines = self.rcLines
-        rcLines.reverse()
         # execute every line only once
         self.rcLines = []
-        while rcLines:
-            line = rcLines.pop().strip()
+        for i, line in enumerate(rcLines):
+            line = line.strip()
             if line and line[0] != '#':
                 if self.onecmd(line):
                     # if onecmd returns True, the command wants to exit
                     # from the interaction, save leftover rc lines
                     # to execute before next interaction
-                    self.rcLines += reversed(rcLines)
+                    self.rcLines += rcLines[i+1:]
                     return True
 
     # Override Bdb methods
@@ -603,6 +692,8 @@ class Pdb(bdb.Bdb, cmd.Cmd):
 
     # Called before loop, handles display expressions
     def preloop(self):
+        if not self.displaying:
+            return
         displaying = self.displaying.get(self.curframe)
         if displaying:
             for expr, oldvalue in displaying.items():
@@ -674,7 +765,10 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         ns = self.curframe.f_globals.copy()
         ns.update(locals)
         try:
-            code = compile(line + '\n', '<stdin>', 'single', 0, True)
+            code = _statements.get(line)
+            if code is None:
+                code = compile(line + '\n', '<stdin>', 'single', 0, True)
+                _cache_code(_statements, line, code)
             self.redirect(exec_, code, ns, locals)
         except Exception:
             exc_info = sys.exc_info()[:2]
@@ -682,21 +776,23 @@ class Pdb(bdb.Bdb, cmd.Cmd):
 
     def precmd(self, line):
         """Handle alias expansion and ';;' separator."""
+        if not self.aliases and ';;' not in line:
+            return line
         if not line.strip():
             return line
-        args = line.split()
-        while args[0] in self.aliases:
-            line = self.aliases[args[0]]
-            ii = 1
-            for tmpArg in args[1:]:
-                line = line.replace("%" + str(ii),
-                                      tmpArg)
-                ii += 1
-            line = line.replace("%*", ' '.join(args[1:]))
+        first = line.split(None, 1)[0]
+        if first in self.aliases:
             args = line.split()
+            while args[0] in self.aliases:
+                line = self.aliases[args[0]]
+                if '%' in line:
+                    line = _alias_params.sub(lambda m: _alias_param(m, args),
+                                             line)
+                args = line.split()
+            first = args[0]
         # split into ';;' separated commands
         # unless it's an alias command
-        if args[0] != 'alias':
+        if first != 'alias':
             marker = line.find(';;')
             if marker >= 0:
                 # queue up everything after marker
@@ -767,11 +863,12 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         except Exception:
             ret = []
         # Then, try to complete file names as well.
+        import glob
         globs = glob.glob(text + '*')
         for fn in globs:
             if os.path.isdir(fn):
                 ret.append(fn + '/')
-            elif os.path.isfile(fn) and fn.lower().endswith(('.py', '.pyw')):
+            elif fn.lower().endswith(('.py', '.pyw')) and os.path.isfile(fn):
                 ret.append(fn + ':')
         return ret
 
@@ -779,8 +876,9 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         # Complete a breakpoint number.  (This would be more helpful if we could
         # display additional info along with the completions, such as file/line
         # of the breakpoint.)
-        return [str(i) for i, bp in enumerate(bdb.Breakpoint.bpbynumber)
-                if bp is not None and str(i).startswith(text)]
+        numbers = (str(i) for i, bp in enumerate(bdb.Breakpoint.bpbynumber)
+                   if bp is not None)
+        return [n for n in numbers if n.startswith(text)]
 
     def _complete_expression(self, text, line, begidx, endidx):
         # Complete an arbitrary expression.
@@ -788,16 +886,18 @@ class Pdb(bdb.Bdb, cmd.Cmd):
             return []
         # Collect globals and locals.  It is usually not really sensible to also
         # complete builtins, and they clutter the namespace quite heavily, so we
-        # leave them out.
-        ns = self.curframe.f_globals.copy()
-        ns.update(self.get_locals(self.curframe))
+        # leave them out.  The locals override the globals and are looked up
+        # first, instead of copying a possibly large globals dictionary on
+        # each completion.
+        globs = self.curframe.f_globals
+        locs = self.get_locals(self.curframe)
         if '.' in text:
             # Walk an attribute chain up to the last part, similar to what
             # rlcompleter does.  This will bail if any of the parts are not
             # simple attribute access, which is what we want.
             dotted = text.split('.')
             try:
-                obj = ns[dotted[0]]
+                obj = locs[dotted[0]] if dotted[0] in locs else globs[dotted[0]]
                 for part in dotted[1:-1]:
                     obj = getattr(obj, part)
             except (KeyError, AttributeError):
@@ -806,7 +906,10 @@ class Pdb(bdb.Bdb, cmd.Cmd):
             return [prefix + n for n in dir(obj) if n.startswith(dotted[-1])]
         else:
             # Complete a simple name.
-            return [n for n in ns.keys() if n.startswith(text)]
+            names = [n for n in globs if n.startswith(text)]
+            names.extend(n for n in locs
+                            if n.startswith(text) and n not in globs)
+            return names
 
     # Command definitions, called by cmdloop()
     # The argument is the remaining string on the command line
@@ -1262,6 +1365,7 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         are preserved.  "restart" is an alias for "run".
         """
         if arg:
+            import shlex
             argv0 = sys.argv[0:1]
             sys.argv = shlex.split(arg)
             sys.argv[:0] = argv0
@@ -1396,7 +1500,7 @@ class Pdb(bdb.Bdb, cmd.Cmd):
 
     def _getval(self, arg):
         try:
-            return eval_(arg, self.curframe.f_globals,
+            return eval(_compile_expr(arg), self.curframe.f_globals,
                             self.get_locals(self.curframe))
         except Exception:
             exc_info = sys.exc_info()[:2]
@@ -1405,11 +1509,12 @@ class Pdb(bdb.Bdb, cmd.Cmd):
 
     def _getval_except(self, arg, frame=None):
         try:
+            code = _compile_expr(arg)
             if frame is None:
-                return eval_(arg, self.curframe.f_globals,
+                return eval(code, self.curframe.f_globals,
                                 self.get_locals(self.curframe))
             else:
-                return eval_(arg, frame.f_globals, frame.f_locals)
+                return eval(code, frame.f_globals, frame.f_locals)
         except Exception:
             exc_info = sys.exc_info()[:2]
             err = traceback.format_exception_only(*exc_info)[-1].strip()
@@ -1434,6 +1539,7 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         except Exception:
             self.message(bdb.safe_repr(obj))
         else:
+            import pprint
             self.message(pprint.pformat(obj))
 
     complete_print = _complete_expression
@@ -1530,19 +1636,21 @@ class Pdb(bdb.Bdb, cmd.Cmd):
             exc_lineno = self.tb_lineno.get(frame, -1)
         else:
             current_lineno = exc_lineno = -1
+        breaks = set(breaks)
+        # Print all the lines with a single message.
+        out = []
         for lineno, line in enumerate(lines, start):
-            s = str(lineno).rjust(3)
-            if len(s) < 4:
-                s += ' '
-            if lineno in breaks:
-                s += 'B'
-            else:
-                s += ' '
             if lineno == current_lineno:
-                s += '->'
+                marker = '->'
             elif lineno == exc_lineno:
-                s += '>>'
-            self.message(s + '\t' + line.rstrip())
+                marker = '>>'
+            else:
+                marker = ''
+            out.append('%-4s%s%s\t%s' % ('%3d' % lineno,
+                                          'B' if lineno in breaks else ' ',
+                                          marker, line.rstrip()))
+        if out:
+            self.message('\n'.join(out))
 
     def do_whatis(self, arg):
         """whatis arg
@@ -1632,6 +1740,7 @@ class Pdb(bdb.Bdb, cmd.Cmd):
                 raise EOFError
             return line
 
+        import code
         ns = self.curframe.f_globals.copy()
         ns.update(self.get_locals(self.curframe))
         if isinstance(self.stdin, RemoteSocket):
@@ -1703,11 +1812,10 @@ class Pdb(bdb.Bdb, cmd.Cmd):
                 else:
                     frame = current_frames.get(t.ident)
                 if frame:
-                    stack_entry = self.format_stack_entry(
-                            (frame, frame.f_lineno), line_prefix).split('\n')
+                    entry, _, line = self.format_stack_entry(
+                        (frame, frame.f_lineno), line_prefix).partition('\n')
                     self.message('{} {:3d} {:18} {:16d} {}\n{:43}{}'.format(
-                        prefix, nb, t.name, t.ident, stack_entry[0],
-                        '', stack_entry[1]))
+                        prefix, nb, t.name, t.ident, entry, '', line))
                 else:
                     self.message('{} {:3d} {:18} {:16d} {}'.format(
                         prefix, nb, t.name, t.ident, 'Thread not active.'))
@@ -1781,7 +1889,7 @@ class Pdb(bdb.Bdb, cmd.Cmd):
         if not self.current_thread:
             self.current_thread = self.pdb_thread
         current_frames = sys._current_frames()
-        tlist = sorted(threading.enumerate(), key=attrgetter('name', 'ident'))
+        tlist = sorted(threading.enumerate(), key=_thread_key)
         try:
             self._do_thread(arg, current_frames, tlist)
         finally:
@@ -1792,9 +1900,9 @@ class Pdb(bdb.Bdb, cmd.Cmd):
     def complete_unalias(self, text, line, begidx, endidx):
         return [a for a in self.aliases if a.startswith(text)]
 
-    # List of all the commands making the program resume execution.
-    commands_resuming = ['do_continue', 'do_step', 'do_next', 'do_return',
-                         'do_quit', 'do_jump']
+    # Set of all the commands making the program resume execution.
+    commands_resuming = frozenset(['do_continue', 'do_step', 'do_next',
+                                   'do_return', 'do_quit', 'do_jump'])
 
     # Print a traceback starting at the top stack frame.
     # The most recently entered frame is printed last;
@@ -1880,10 +1988,18 @@ class Pdb(bdb.Bdb, cmd.Cmd):
 
         self.mainpyfile = filename
         self._user_requested_quit = False
-        with open(filename, "rb") as fp:
-            content = fp.read()
+        # Do not compile the script again on a restart when it has not
+        # changed.
+        st = os.stat(filename)
+        stamp = (st.st_mtime, st.st_size)
+        cached = _scripts.get(filename)
+        if cached is None or cached[0] != stamp:
+            with open(filename, "rb") as fp:
+                content = fp.read()
+            cached = (stamp, compile(content, filename, 'exec', 0, True))
+            _scripts[filename] = cached
         self.forget()
-        self.run(compile(content, self.mainpyfile, 'exec', 0, True))
+        self.run(cached[1])
 
 # Collect all command help into docstring, if not run with -OO
 
@@ -1968,6 +2084,7 @@ def help(stdout=sys.stdout):
     save_stdout = sys.stdout
     try:
         sys.stdout = stdout
+        import pydoc
         pydoc.pager(__doc__)
         # Ends the pager output on a newline to enable prompt detection when
         # doing remote debugging.